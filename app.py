@@ -1,8 +1,14 @@
+import io
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import date, datetime
+from itertools import islice
+import numpy as np
 import pandas as pd
 import streamlit as st
+from rapidfuzz import fuzz, process, utils
 
 # =========================
 # Config
@@ -10,9 +16,45 @@ import streamlit as st
 EXCEL_PATH = "Prueba Tecnica2_LIMPIO.xlsx"
 DB_PATH = "capacitaciones.db"
 
+# Columnas de baja cardinalidad: read_df las entrega como category (códigos enteros)
+_CAT_COLS = {"cargo", "proceso", "lugar_trabajo", "resultado", "tipo_evento", "esquema_evento", "tema_general"}
+
 st.set_page_config(page_title="Capacitaciones - RRHH", layout="wide")
 
 
+# =========================
+# SQL
+# =========================
+# Texto idéntico en cada llamada => sqlite3 reutiliza la sentencia ya compilada
+SQL_UPSERT_PERSONA = """
+INSERT INTO personas(id_persona, nombre, cargo, proceso, lugar_trabajo)
+VALUES(?,?,?,?,?)
+ON CONFLICT(id_persona) DO UPDATE SET
+  nombre=excluded.nombre,
+  cargo=excluded.cargo,
+  proceso=excluded.proceso,
+  lugar_trabajo=excluded.lugar_trabajo
+"""
+
+SQL_UPSERT_EVENTO = """
+INSERT INTO eventos(id_evento, tipo_evento, tema_general, nombre_evento, esquema_evento, duracion_horas)
+VALUES(?,?,?,?,?,?)
+ON CONFLICT(id_evento) DO UPDATE SET
+  tipo_evento=excluded.tipo_evento,
+  tema_general=excluded.tema_general,
+  nombre_evento=excluded.nombre_evento,
+  esquema_evento=excluded.esquema_evento,
+  duracion_horas=excluded.duracion_horas
+"""
+
+SQL_INSERT_PROGRAMACION = "INSERT OR IGNORE INTO programacion(id_evento, cargo, mes) VALUES(?,?,?)"
+
+SQL_INSERT_REGISTRO = """
+INSERT INTO registro(id_persona, id_evento, fecha_ejecucion, horas, resultado)
+VALUES(?,?,?,?,?)
+"""
+
+
 # =========================
 # Helpers
 # =========================
@@ -20,20 +62,51 @@ def month_start(d: date) -> str:
     return date(d.year, d.month, 1).isoformat()
 
 
-def safe_is_p(val) -> bool:
-    """Detecta si una celda indica programación/aplica (ej: 'P')."""
-    if val is None or (isinstance(val, float) and pd.isna(val)) or pd.isna(val):
-        return False
-    s = str(val).strip().upper()
-    return s == "P" or s.startswith("P")
+def col_is_p(s: pd.Series) -> np.ndarray:
+    """Detecta, para toda una columna, qué celdas indican programación/aplica (ej: 'P')."""
+    return s.notna().to_numpy() & s.astype(str).str.strip().str.upper().str.startswith("P", na=False).to_numpy(dtype=bool)
+
 
+def _cell_text(v):
+    """Celda openpyxl como texto (None si está vacía); 2.0 -> "2" igual que pandas."""
+    if v is None:
+        return None
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    v = str(v).strip()
+    return v or None
 
-def conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+
+def _apply_pragmas(c: sqlite3.Connection):
+    """WAL + synchronous=NORMAL: las escrituras masivas no pagan un fsync por sentencia."""
+    c.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+    """)
+
+
+@st.cache_resource
+def get_conn():
+    """Una sola conexión compartida entre reruns y sesiones (las PRAGMAs se aplican una vez)."""
+    c = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+    _apply_pragmas(c)
+    return c
+
+
+@st.cache_resource
+def get_db_lock():
+    """
+    Candado de la conexión compartida: una sola sesión/hilo a la vez la usa.
+    Reentrante para que transaction() pueda anidarse dentro del mismo hilo.
+    """
+    return threading.RLock()
 
 
 def init_db():
-    with conn() as c:
+    with transaction() as c:
         c.execute("""
         CREATE TABLE IF NOT EXISTS personas(
             id_persona TEXT PRIMARY KEY,
@@ -67,18 +140,96 @@ def init_db():
             horas REAL,
             resultado TEXT
         )""")
-        c.commit()
+        c.execute("CREATE INDEX IF NOT EXISTS idx_personas_cargo ON personas(cargo)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_prog_cargo_mes ON programacion(cargo, mes)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reg_persona ON registro(id_persona)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reg_evento_fecha ON registro(id_evento, fecha_ejecucion)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reg_fecha ON registro(fecha_ejecucion DESC, id DESC)")
 
 
 def read_df(query: str, params=()):
-    with conn() as c:
-        return pd.read_sql_query(query, c, params=params)
+    # sin "with get_conn()": el context manager de sqlite3 haría commit de una transacción abierta
+    with get_db_lock():
+        df = pd.read_sql_query(query, get_conn(), params=params)
+    for col in [c for c in df.columns if c in _CAT_COLS]:
+        df[col] = df[col].astype("category")
+    return df
+
+
+@st.cache_data(show_spinner=False, ttl=600, max_entries=256)
+def cached_read(query: str, params=()):
+    """
+    read_df memoizado; cualquier escritura lo invalida con invalidate_caches().
+    Acotado (ttl/max_entries) porque la llave incluye params: cada cargo/mes/evento
+    consultado agrega una entrada compartida por todas las sesiones.
+    """
+    return read_df(query, tuple(params))
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def table_csv(name: str) -> bytes:
+    """
+    CSV de la tabla escrito directo a bytes (sin str intermedio), memoizado;
+    como cached_read, se invalida con invalidate_caches().
+    """
+    buf = io.BytesIO()
+    read_df(f"SELECT * FROM {name}").to_csv(buf, index=False, encoding="utf-8", chunksize=50_000)
+    return buf.getvalue()
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def table_counts():
+    """(personas, eventos, programacion, registro) en un solo query, sin DataFrame."""
+    with get_db_lock():
+        return get_conn().execute("""
+            SELECT (SELECT COUNT(*) FROM personas),
+                   (SELECT COUNT(*) FROM eventos),
+                   (SELECT COUNT(*) FROM programacion),
+                   (SELECT COUNT(*) FROM registro)
+        """).fetchone()
+
+
+def _is_empty(table: str) -> bool:
+    # LIMIT 1: se detiene en la primera fila en vez de contar toda la tabla
+    with get_db_lock():
+        return get_conn().execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+
+
+def invalidate_caches():
+    cached_read.clear()
+    table_csv.clear()
+    table_counts.clear()
+
+
+@contextmanager
+def transaction():
+    """
+    BEGIN IMMEDIATE ... COMMIT (ROLLBACK si algo falla) sobre la conexión compartida.
+    Todo el bloque corre con get_db_lock() tomado: otra sesión espera en vez de
+    sumarse a esta transacción. Si el mismo hilo ya tiene una abierta (el RLock
+    es suyo) se suma a ella y el commit lo hace la externa.
+    """
+    with get_db_lock():
+        c = get_conn()
+        if c.in_transaction:
+            yield c
+            return
+
+        changes = c.total_changes
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+        if c.total_changes != changes:  # el DDL idempotente de init_db no vacía los cachés
+            invalidate_caches()
 
 
 def exec_sql(query: str, params=()):
-    with conn() as c:
+    with transaction() as c:
         c.execute(query, params)
-        c.commit()
 
 
 def normalize_cols(df: pd.DataFrame):
@@ -86,21 +237,97 @@ def normalize_cols(df: pd.DataFrame):
     return df
 
 
-def apply_colmap_fuzzy(df: pd.DataFrame, colmap: dict, required: list, table_name: str):
-    df = normalize_cols(df)
-
+def match_cols(cols, colmap: dict) -> dict:
+    """
+    {columna original: nombre destino} para las columnas que corresponden a colmap.
+    Primero coincidencia exacta (sin mayúsculas/espacios); si no, la mejor
+    coincidencia aproximada de rapidfuzz (score >= 85). El scorer compara el
+    texto completo (token_sort_ratio, no WRatio) para que 'Id Cargo' o
+    'Horas Programadas' no pasen por 'cargo' u 'horas', y solo entre nombres que
+    coinciden en el token 'id': 'Evento Formativo' nunca cae en 'Id Evento
+    Formativo' ni 'Id Lugar de Trabajo' en 'Lugar de Trabajo'. Cada destino se
+    asigna a una sola columna: la de mayor score.
+    """
     def key(x):
         return str(x).strip().lower()
 
-    df_cols_map = {key(c): c for c in df.columns}
+    def has_id(x):
+        return "id" in utils.default_process(x).split()
+
     cmap_norm = {key(k): v for k, v in colmap.items()}
 
-    rename = {}
-    for k_norm, dst in cmap_norm.items():
-        if k_norm in df_cols_map:
-            rename[df_cols_map[k_norm]] = dst
+    best = {}  # destino -> (score, columna)
+    for c in cols:
+        k = key(c)
+        if k in cmap_norm:
+            dst, score = cmap_norm[k], 101.0  # exacta siempre gana a una aproximada
+        else:
+            hit = process.extractOne(
+                k, [ck for ck in cmap_norm if has_id(ck) == has_id(k)],
+                scorer=fuzz.token_sort_ratio, processor=utils.default_process, score_cutoff=85
+            )
+            if hit is None:
+                continue
+            dst, score = cmap_norm[hit[0]], hit[1]
+        if dst not in best or score > best[dst][0]:
+            best[dst] = (score, c)
+
+    return {c: dst for dst, (_, c) in best.items()}
 
-    df = df.rename(columns=rename)
+
+def read_mapped_sheet(xl: pd.ExcelFile, sheet: str, colmap: dict, str_cols=(), required=()):
+    """
+    Lee de la hoja solo las columnas que mapean en colmap (las de str_cols como texto).
+    Si falta alguna columna destino de `required` devuelve None sin leer el cuerpo.
+    """
+    rename = match_cols(xl.parse(sheet, nrows=0).columns, colmap)
+    if any(c not in rename.values() for c in required):
+        return None
+    dtype = {c: str for c, dst in rename.items() if dst in str_cols}
+    return pd.read_excel(xl, sheet_name=sheet, usecols=list(rename), dtype=dtype)
+
+
+def stream_mapped_sheet(xl: pd.ExcelFile, sheet: str, colmap: dict, str_cols=(), required=(), max_empty: int = 1000):
+    """
+    Como read_mapped_sheet, pero recorre la hoja en streaming sobre xl.book.
+    Para hojas con formato aplicado hasta la última fila de Excel: las filas sin
+    ninguna de las columnas `required` se descartan y, tras max_empty seguidas,
+    se deja de leer avisando con st.warning (lo que siga más abajo no se importa).
+    """
+    ws = xl.book[sheet]
+    rows = ws.iter_rows(values_only=True)
+    header = [c.strip() if isinstance(c, str) else c for c in next(rows, ())]
+    rename = match_cols([c for c in header if c is not None], colmap)
+    if any(c not in rename.values() for c in required):
+        return None
+
+    idx = [header.index(c) for c in rename]
+    key_idx = [i for i in idx if rename[header[i]] in required]
+    str_idx = {i for i in idx if rename[header[i]] in str_cols}
+
+    data, empty_run = [], 0
+    for n_row, row in enumerate(rows, start=2):
+        row = row + (None,) * (len(header) - len(row))
+        if all(_cell_text(row[i]) is None for i in key_idx):
+            empty_run += 1
+            if empty_run >= max_empty:
+                if ws.max_row is None or n_row < ws.max_row:
+                    st.warning(
+                        f"'{sheet}': lectura detenida en la fila {n_row} tras {max_empty} filas seguidas sin "
+                        f"{', '.join(required)} (la hoja llega hasta la fila {ws.max_row}). "
+                        f"Si hay registros más abajo, elimine las filas vacías intermedias."
+                    )
+                break
+            continue
+        empty_run = 0
+        data.append([_cell_text(row[i]) if i in str_idx else row[i] for i in idx])
+
+    return pd.DataFrame(data, columns=list(rename))
+
+
+def apply_colmap_fuzzy(df: pd.DataFrame, colmap: dict, required: list, table_name: str):
+    df = normalize_cols(df)
+    df = df.rename(columns=match_cols(df.columns, colmap))
 
     missing = [c for c in required if c not in df.columns]
     if missing:
@@ -112,129 +339,133 @@ def apply_colmap_fuzzy(df: pd.DataFrame, colmap: dict, required: list, table_nam
 
 
 def upsert_many_personas(df: pd.DataFrame):
-    with conn() as c:
-        for _, r in df.iterrows():
-            c.execute("""
-            INSERT INTO personas(id_persona, nombre, cargo, proceso, lugar_trabajo)
-            VALUES(?,?,?,?,?)
-            ON CONFLICT(id_persona) DO UPDATE SET
-              nombre=excluded.nombre,
-              cargo=excluded.cargo,
-              proceso=excluded.proceso,
-              lugar_trabajo=excluded.lugar_trabajo
-            """, (str(r["id_persona"]), r["nombre"], r["cargo"], r["proceso"], r["lugar_trabajo"]))
-        c.commit()
+    rows = [
+        (str(id_persona), nombre, cargo, proceso, lugar_trabajo)
+        for id_persona, nombre, cargo, proceso, lugar_trabajo in df[
+            ["id_persona", "nombre", "cargo", "proceso", "lugar_trabajo"]
+        ].itertuples(index=False, name=None)
+    ]
+    with transaction() as c:
+        c.executemany(SQL_UPSERT_PERSONA, rows)
 
 
 def upsert_many_eventos(df: pd.DataFrame):
-    with conn() as c:
-        for _, r in df.iterrows():
-            c.execute("""
-            INSERT INTO eventos(id_evento, tipo_evento, tema_general, nombre_evento, esquema_evento, duracion_horas)
-            VALUES(?,?,?,?,?,?)
-            ON CONFLICT(id_evento) DO UPDATE SET
-              tipo_evento=excluded.tipo_evento,
-              tema_general=excluded.tema_general,
-              nombre_evento=excluded.nombre_evento,
-              esquema_evento=excluded.esquema_evento,
-              duracion_horas=excluded.duracion_horas
-            """, (
-                str(r["id_evento"]),
-                r["tipo_evento"],
-                r["tema_general"],
-                r["nombre_evento"],
-                r["esquema_evento"],
-                float(r["duracion_horas"])
-            ))
-        c.commit()
+    rows = [
+        (str(id_evento), tipo_evento, tema_general, nombre_evento, esquema_evento, float(duracion_horas))
+        for id_evento, tipo_evento, tema_general, nombre_evento, esquema_evento, duracion_horas in df[
+            ["id_evento", "tipo_evento", "tema_general", "nombre_evento", "esquema_evento", "duracion_horas"]
+        ].itertuples(index=False, name=None)
+    ]
+    with transaction() as c:
+        c.executemany(SQL_UPSERT_EVENTO, rows)
 
 
 def upsert_many_programacion(df: pd.DataFrame):
     if df is None or len(df) == 0:
         return
-    with conn() as c:
-        for _, r in df.iterrows():
-            c.execute("""
-            INSERT OR IGNORE INTO programacion(id_evento, cargo, mes)
-            VALUES(?,?,?)
-            """, (str(r["id_evento"]), str(r["cargo"]), str(r["mes"])))
-        c.commit()
+    rows = [
+        (str(id_evento), str(cargo), str(mes))
+        for id_evento, cargo, mes in df[["id_evento", "cargo", "mes"]].drop_duplicates().itertuples(index=False, name=None)
+    ]
+    with transaction() as c:
+        c.executemany(SQL_INSERT_PROGRAMACION, rows)
+
+
+def insert_many_registro(df: pd.DataFrame):
+    if df is None or len(df) == 0:
+        return
+    rows = list(
+        df[["id_persona", "id_evento", "fecha_ejecucion", "horas", "resultado"]].itertuples(index=False, name=None)
+    )
+    with transaction() as c:
+        c.executemany(SQL_INSERT_REGISTRO, rows)
 
 
 # =========================
 # Import Excel
 # =========================
-def parse_programacion_from_matriz(xl: pd.ExcelFile) -> pd.DataFrame:
+def parse_programacion_from_matriz(xl: pd.ExcelFile, chunk_rows: int = 5000) -> pd.DataFrame:
     """
     Matriz Programación:
     - Filas: eventos (Id Evento, Tema General, Evento Formativo, Tipo de Evento, etc.)
     - Columnas: meses (datetime 2022-01-01...) con 'P' indicando mes programado
     - Columnas: cargos (texto) con 'P' indicando que el evento aplica a ese cargo
     Regla: si (cargo=P) y (mes=P) => programacion(id_evento, cargo, mes)
+
+    La hoja se recorre en streaming sobre el libro openpyxl (read-only) que ya abrió
+    xl, en bloques de chunk_rows filas: nunca se materializa la matriz completa.
     """
-    dfm = pd.read_excel(xl, sheet_name="Matriz Programación")
-    dfm = normalize_cols(dfm)
+    rows = xl.book["Matriz Programación"].iter_rows(values_only=True)
+    header = [c.strip() if isinstance(c, str) else c for c in next(rows, ())]
 
     # Asegurar Id Evento (viene como 'Id Evento')
-    if "Id Evento" not in dfm.columns:
+    if "Id Evento" not in header:
         raise ValueError("No encontré 'Id Evento' en Matriz Programación.")
+    id_idx = header.index("Id Evento")
 
     # Meses = columnas tipo datetime
-    month_cols = [c for c in dfm.columns if isinstance(c, (datetime, pd.Timestamp))]
-    if len(month_cols) == 0:
-        # fallback: intenta parsear columnas que parezcan fechas
-        for c in dfm.columns:
+    month_idx = [i for i, c in enumerate(header) if isinstance(c, datetime)]
+    if len(month_idx) == 0:
+        # fallback: intenta parsear encabezados que parezcan fechas
+        for i, c in enumerate(header):
+            if c is None:
+                continue
             try:
-                dt = pd.to_datetime(c, errors="raise")
-                month_cols.append(dt.to_pydatetime())
+                pd.to_datetime(str(c), errors="raise")
+                month_idx.append(i)
             except Exception:
                 pass
+    month_strs = np.array([month_start(pd.to_datetime(header[i]).date()) for i in month_idx], dtype=object)
 
-    # Cargos = columnas string (no Unnamed, no columnas base)
+    # Cargos = columnas string (no Unnamed, no columnas base, no meses)
     base_cols = {"Id Evento", "Tema General", "Evento Formativo", "Tipo de Evento"}
-    cargo_cols = [
-        c for c in dfm.columns
+    cargo_idx = [
+        i for i, c in enumerate(header)
         if isinstance(c, str)
         and c not in base_cols
+        and i not in month_idx
         and not c.lower().startswith("unnamed")
-        and c.strip() != ""
+        and c != ""
     ]
-
-    records = []
-    for _, row in dfm.iterrows():
-        id_evento = row.get("Id Evento", None)
-        if pd.isna(id_evento):
-            continue
-        id_evento = str(id_evento).strip()
-
-        # Cargos aplicables
-        cargos_aplican = []
-        for cc in cargo_cols:
-            if safe_is_p(row.get(cc, None)):
-                cargos_aplican.append(str(cc).strip())
-
-        if len(cargos_aplican) == 0:
-            continue
-
-        # Meses programados
-        meses_programados = []
-        for mc in month_cols:
-            if safe_is_p(row.get(mc, None)):
-                # mc ya es datetime/timestamp
-                dt = pd.to_datetime(mc).date()
-                meses_programados.append(month_start(dt))
-
-        if len(meses_programados) == 0:
-            continue
-
-        for cargo in cargos_aplican:
-            for mes in meses_programados:
-                records.append({"id_evento": id_evento, "cargo": cargo, "mes": mes})
-
-    if len(records) == 0:
+    cargo_strs = np.array([header[i] for i in cargo_idx], dtype=object)
+
+    ev_parts, cargo_parts, mes_parts = [], [], []
+    for chunk in iter(lambda: list(islice(rows, chunk_rows)), []):
+        block = pd.DataFrame(chunk).reindex(columns=range(len(header)))
+
+        # Matrices booleanas (filas x columnas) con 'P' para el bloque
+        def is_p_matrix(cols):
+            if len(cols) == 0:
+                return np.zeros((len(block), 0), dtype=bool)
+            return np.column_stack([col_is_p(block[i]) for i in cols])
+
+        cargo_mat = is_p_matrix(cargo_idx)
+        month_mat = is_p_matrix(month_idx)
+
+        ids = block[id_idx]
+        for i in range(len(block)):
+            id_evento = _cell_text(ids.iat[i])
+            if id_evento is None:  # vacía o solo espacios (notna() no la descarta)
+                continue
+
+            cs = np.flatnonzero(cargo_mat[i])
+            ms = np.flatnonzero(month_mat[i])
+            if len(cs) == 0 or len(ms) == 0:
+                continue
+
+            # producto cartesiano cargo x mes de la fila
+            ev_parts.append(np.full(len(cs) * len(ms), id_evento, dtype=object))
+            cargo_parts.append(cargo_strs[np.repeat(cs, len(ms))])
+            mes_parts.append(month_strs[np.tile(ms, len(cs))])
+
+    if len(ev_parts) == 0:
         return pd.DataFrame(columns=["id_evento", "cargo", "mes"])
 
-    dfp = pd.DataFrame(records).drop_duplicates()
+    dfp = pd.DataFrame({
+        "id_evento": np.concatenate(ev_parts),
+        "cargo": np.concatenate(cargo_parts),
+        "mes": np.concatenate(mes_parts),
+    }).drop_duplicates()
     return dfp
 
 
@@ -243,51 +474,36 @@ def import_from_excel(path: str):
     SHEET_EVENTOS = "Eventos formativos"
     SHEET_REGISTRO = "Registro Eventos Formativos"
 
+    # Variantes de mayúsculas, espacios, acentos o typos las resuelve match_cols
     COLMAP_PERSONAS = {
-        "Id persona": "id_persona",
         "Id Persona": "id_persona",
-        "IdPersona": "id_persona",
-        "ID Persona": "id_persona",
         "Nombre Completo": "nombre",
         "Nombre": "nombre",
         "Cargo": "cargo",
-        "cargo": "cargo",
         "Proceso": "proceso",
-        "proceso": "proceso",
         "Lugar de Trabajo": "lugar_trabajo",
-        "Lugar de trabajo": "lugar_trabajo",
-        "lugar_trabajo": "lugar_trabajo",
-        "LugarTrabajo": "lugar_trabajo",
     }
     REQ_PERSONAS = ["id_persona", "nombre", "cargo", "proceso", "lugar_trabajo"]
 
     COLMAP_EVENTOS = {
         "Id Evento": "id_evento",
-        "Id evento": "id_evento",
-        "IdEvento": "id_evento",
         "Tema General": "tema_general",
-        "Tema general": "tema_general",
-        "TemaGeneral": "tema_general",
         "Evento Formativo": "nombre_evento",
         "Nombre del Evento": "nombre_evento",
         "NombreEvento": "nombre_evento",
         "Esquema de Evento": "esquema_evento",
-        "Esquema evento": "esquema_evento",
-        "EsquemaEvento": "esquema_evento",
     }
     REQ_EVENTOS = ["id_evento", "tema_general", "nombre_evento", "esquema_evento"]
 
     COLMAP_REG = {
         "Id Persona": "id_persona",
-        "Id persona": "id_persona",
-        "IdPersona": "id_persona",
         "Id Evento": "id_evento",
-        "Id evento": "id_evento",
-        "IdEvento": "id_evento",
+        "Id Evento Formativo": "id_evento",
         "Fecha": "fecha_ejecucion",
         "Fecha Ejecución": "fecha_ejecucion",
-        "FechaEjecucion": "fecha_ejecucion",
+        "Fecha de ejecución": "fecha_ejecucion",
         "Horas": "horas",
+        "Cantidad de Horas": "horas",
         "Duración": "horas",
         "Resultado": "resultado",
         "Aprobó/Reprobó": "resultado",
@@ -297,15 +513,16 @@ def import_from_excel(path: str):
     xl = pd.ExcelFile(path)
 
     # Personas
-    dfp = pd.read_excel(xl, sheet_name=SHEET_PERSONAS)
+    dfp = read_mapped_sheet(xl, SHEET_PERSONAS, COLMAP_PERSONAS, str_cols=["id_persona"])
     dfp = apply_colmap_fuzzy(dfp, COLMAP_PERSONAS, REQ_PERSONAS, "Personas")
-    dfp = dfp[REQ_PERSONAS].copy()
-    dfp["id_persona"] = dfp["id_persona"].astype(str).str.strip()
-    dfp = dfp.dropna(subset=["id_persona"])
-    dfp = dfp[dfp["id_persona"] != ""]
+    dfp = (
+        dfp[REQ_PERSONAS]
+        .assign(id_persona=lambda d: d["id_persona"].astype("string").str.strip())
+        .loc[lambda d: d["id_persona"].fillna("") != ""]
+    )
 
     # Eventos (la hoja real trae 'Esquema de Evento' como CAPACITACION)
-    dfe = pd.read_excel(xl, sheet_name=SHEET_EVENTOS)
+    dfe = read_mapped_sheet(xl, SHEET_EVENTOS, COLMAP_EVENTOS, str_cols=["id_evento"])
     dfe = apply_colmap_fuzzy(dfe, COLMAP_EVENTOS, REQ_EVENTOS, "Eventos")
 
     # Defaults / limpieza
@@ -314,21 +531,22 @@ def import_from_excel(path: str):
         dfe["duracion_horas"] = 1.0
     dfe["duracion_horas"] = pd.to_numeric(dfe["duracion_horas"], errors="coerce").fillna(1.0)
 
-    dfe = dfe[REQ_EVENTOS + ["tipo_evento", "duracion_horas"]].copy()
-    dfe["id_evento"] = dfe["id_evento"].astype(str).str.strip()
-    dfe = dfe.dropna(subset=["id_evento"])
-    dfe = dfe[dfe["id_evento"] != ""]
+    dfe = (
+        dfe[REQ_EVENTOS + ["tipo_evento", "duracion_horas"]]
+        .assign(id_evento=lambda d: d["id_evento"].astype("string").str.strip())
+        .loc[lambda d: d["id_evento"].fillna("") != ""]
+    )
 
     # Programación desde Matriz
     dfprog = parse_programacion_from_matriz(xl)
 
     # Registro (opcional)
-    dfr = pd.read_excel(xl, sheet_name=SHEET_REGISTRO)
-    dfr = normalize_cols(dfr)
-    rename_reg = {k: v for k, v in COLMAP_REG.items() if k in dfr.columns}
-    dfr = dfr.rename(columns=rename_reg)
+    # (si faltan las columnas mínimas no se lee el cuerpo de la hoja; la hoja trae
+    # formato hasta la fila 1.048.576, por eso se lee en streaming y no con read_excel)
+    dfr = stream_mapped_sheet(xl, SHEET_REGISTRO, COLMAP_REG, str_cols=REQ_REG_MIN, required=REQ_REG_MIN)
 
-    if all(c in dfr.columns for c in REQ_REG_MIN):
+    if dfr is not None:
+        dfr = apply_colmap_fuzzy(dfr, COLMAP_REG, REQ_REG_MIN, "Registro")
         if "fecha_ejecucion" not in dfr.columns:
             dfr["fecha_ejecucion"] = pd.NaT
         if "horas" not in dfr.columns:
@@ -336,16 +554,26 @@ def import_from_excel(path: str):
         if "resultado" not in dfr.columns:
             dfr["resultado"] = None
 
-        dfr = dfr[["id_persona", "id_evento", "fecha_ejecucion", "horas", "resultado"]].copy()
-        dfr["id_persona"] = dfr["id_persona"].astype(str).str.strip()
-        dfr["id_evento"] = dfr["id_evento"].astype(str).str.strip()
-        dfr = dfr.dropna(subset=["id_persona", "id_evento"])
+        dfr = (
+            dfr[["id_persona", "id_evento", "fecha_ejecucion", "horas", "resultado"]]
+            .assign(
+                id_persona=lambda d: d["id_persona"].astype("string").str.strip(),
+                id_evento=lambda d: d["id_evento"].astype("string").str.strip(),
+            )
+            .dropna(subset=["id_persona", "id_evento"])
+        )
     else:
         dfr = pd.DataFrame(columns=["id_persona", "id_evento", "fecha_ejecucion", "horas", "resultado"])
 
     return dfp, dfe, dfprog, dfr
 
 
+@st.cache_data(show_spinner=False)
+def load_excel(path: str, mtime: float):
+    """Parsea el Excel una sola vez por versión del archivo (mtime forma parte de la llave)."""
+    return import_from_excel(path)
+
+
 def load_demo_data(force: bool = False):
     init_db()
 
@@ -353,49 +581,42 @@ def load_demo_data(force: bool = False):
         st.error(f"No encontré {EXCEL_PATH}. Debe estar en la misma carpeta que app.py.")
         return
 
-    if force:
-        exec_sql("DELETE FROM registro")
-        exec_sql("DELETE FROM programacion")
-        exec_sql("DELETE FROM eventos")
-        exec_sql("DELETE FROM personas")
-
-    # Importar siempre (si falla, que falle aquí y lo veas)
-    dfp, dfe, dfprog, dfr = import_from_excel(EXCEL_PATH)
-
-    upsert_many_personas(dfp)
-    upsert_many_eventos(dfe)
-    upsert_many_programacion(dfprog)
-
-    # Registro (si viene con algo)
-    if len(dfr) > 0:
-        for _, r in dfr.iterrows():
-            fecha = r.get("fecha_ejecucion", pd.NaT)
-            if pd.isna(fecha):
-                fecha_str = date.today().isoformat()
-            else:
-                fecha_str = pd.to_datetime(fecha).date().isoformat()
-
-            horas = r.get("horas", None)
-            if horas is None or pd.isna(horas):
-                evh = read_df("SELECT duracion_horas FROM eventos WHERE id_evento=?", (r["id_evento"],))
-                horas = float(evh["duracion_horas"].iloc[0]) if len(evh) else 1.0
-            else:
-                horas = float(horas)
-
-            resultado = r.get("resultado", None)
-            if resultado is None or pd.isna(resultado) or str(resultado).strip() == "":
-                resultado = "Aprobó"
-
-            exec_sql("""
-            INSERT INTO registro(id_persona, id_evento, fecha_ejecucion, horas, resultado)
-            VALUES(?,?,?,?,?)
-            """, (r["id_persona"], r["id_evento"], fecha_str, horas, str(resultado)))
+    # Importar siempre (si falla, que falle aquí y lo veas; la DB queda intacta)
+    dfp, dfe, dfprog, dfr = load_excel(EXCEL_PATH, os.path.getmtime(EXCEL_PATH))
+
+    # Borrado + carga en una sola transacción: un solo commit/fsync
+    with transaction() as c:
+        if force:
+            for t in ("registro", "programacion", "eventos", "personas"):
+                c.execute(f"DELETE FROM {t}")
+
+        upsert_many_personas(dfp)
+        upsert_many_eventos(dfe)
+        upsert_many_programacion(dfprog)
+
+        # Registro (si viene con algo)
+        if len(dfr) > 0:
+            # duraciones en un solo query (evita un SELECT por fila)
+            dur_map = dict(c.execute("SELECT id_evento, duracion_horas FROM eventos").fetchall())
+            fecha = pd.to_datetime(dfr["fecha_ejecucion"], errors="coerce")
+            resultado = dfr["resultado"]
+            dfr = dfr.assign(
+                fecha_ejecucion=fecha.dt.strftime("%Y-%m-%d").fillna(date.today().isoformat()),
+                horas=pd.to_numeric(dfr["horas"], errors="coerce")
+                    .fillna(dfr["id_evento"].map(dur_map))
+                    .fillna(1.0)
+                    .astype(float),
+                resultado=resultado.where(
+                    resultado.notna() & (resultado.astype(str).str.strip() != ""), "Aprobó"
+                ).astype(str),
+            )
+            insert_many_registro(dfr)
+
+    # Estadísticas frescas para el planificador tras la carga masiva
+    exec_sql("ANALYZE")
 
     # Mensaje con conteos para asegurar que NO quede vacío
-    n_p = read_df("SELECT COUNT(*) n FROM personas")["n"].iloc[0]
-    n_e = read_df("SELECT COUNT(*) n FROM eventos")["n"].iloc[0]
-    n_pr = read_df("SELECT COUNT(*) n FROM programacion")["n"].iloc[0]
-    n_r = read_df("SELECT COUNT(*) n FROM registro")["n"].iloc[0]
+    n_p, n_e, n_pr, n_r = table_counts()
     st.success(f"✅ Cargado desde Excel → Personas: {n_p} | Eventos: {n_e} | Programación: {n_pr} | Registro: {n_r}")
 
 
@@ -409,10 +630,7 @@ with st.sidebar:
     st.caption("Excel + SQLite (persistente)")
     try:
         init_db()
-        n_p = read_df("SELECT COUNT(*) n FROM personas")["n"].iloc[0]
-        n_e = read_df("SELECT COUNT(*) n FROM eventos")["n"].iloc[0]
-        n_pr = read_df("SELECT COUNT(*) n FROM programacion")["n"].iloc[0]
-        n_r = read_df("SELECT COUNT(*) n FROM registro")["n"].iloc[0]
+        n_p, n_e, n_pr, n_r = table_counts()
         st.write(f"👥 Personas: **{n_p}**")
         st.write(f"🧾 Eventos: **{n_e}**")
         st.write(f"🗓️ Programación: **{n_pr}**")
@@ -426,15 +644,20 @@ with st.sidebar:
         st.rerun()
 
     if st.button("🧨 Reset DB (borrar archivo)"):
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
+        with get_db_lock():
+            get_conn().close()
+            get_conn.clear()
+            for f in (DB_PATH, f"{DB_PATH}-wal", f"{DB_PATH}-shm"):
+                if os.path.exists(f):
+                    os.remove(f)
+            invalidate_caches()
         st.success("DB eliminada. Vuelve a forzar recarga.")
         st.rerun()
 
 
 # Auto-carga si está vacío (solo la primera vez)
 try:
-    if read_df("SELECT COUNT(*) n FROM personas")["n"].iloc[0] == 0:
+    if _is_empty("personas"):
         load_demo_data(force=False)
 except Exception:
     init_db()
@@ -447,7 +670,7 @@ tabs = st.tabs(["1) Personas", "2) Eventos", "3) Programación", "4) Ejecución"
 # =========================
 with tabs[0]:
     st.subheader("👥 Personas — CRUD")
-    dfp = read_df("SELECT * FROM personas ORDER BY cargo, nombre")
+    dfp = cached_read("SELECT * FROM personas ORDER BY cargo, nombre")
 
     c1, c2 = st.columns([2, 1])
     with c1:
@@ -467,12 +690,7 @@ with tabs[0]:
                 if not idp.strip():
                     st.error("Id Persona es obligatorio.")
                 else:
-                    exec_sql("""
-                    INSERT INTO personas(id_persona, nombre, cargo, proceso, lugar_trabajo)
-                    VALUES(?,?,?,?,?)
-                    ON CONFLICT(id_persona) DO UPDATE SET
-                      nombre=excluded.nombre, cargo=excluded.cargo, proceso=excluded.proceso, lugar_trabajo=excluded.lugar_trabajo
-                    """, (idp.strip(), nombre, cargo, proceso, lugar))
+                    exec_sql(SQL_UPSERT_PERSONA, (idp.strip(), nombre, cargo, proceso, lugar))
                     st.success("Persona guardada.")
                     st.rerun()
         with colB:
@@ -491,7 +709,7 @@ with tabs[0]:
 # =========================
 with tabs[1]:
     st.subheader("🧾 Eventos formativos — CRUD")
-    dfe = read_df("SELECT * FROM eventos ORDER BY tema_general, nombre_evento")
+    dfe = cached_read("SELECT * FROM eventos ORDER BY tema_general, nombre_evento")
 
     c1, c2 = st.columns([2, 1])
     with c1:
@@ -512,16 +730,7 @@ with tabs[1]:
                 if not ide.strip():
                     st.error("Id Evento es obligatorio.")
                 else:
-                    exec_sql("""
-                    INSERT INTO eventos(id_evento, tipo_evento, tema_general, nombre_evento, esquema_evento, duracion_horas)
-                    VALUES(?,?,?,?,?,?)
-                    ON CONFLICT(id_evento) DO UPDATE SET
-                      tipo_evento=excluded.tipo_evento,
-                      tema_general=excluded.tema_general,
-                      nombre_evento=excluded.nombre_evento,
-                      esquema_evento=excluded.esquema_evento,
-                      duracion_horas=excluded.duracion_horas
-                    """, (ide.strip(), tipo, tema, nombre_ev, esquema, float(dur)))
+                    exec_sql(SQL_UPSERT_EVENTO, (ide.strip(), tipo, tema, nombre_ev, esquema, float(dur)))
                     st.success("Evento guardado.")
                     st.rerun()
         with colB:
@@ -539,8 +748,8 @@ with tabs[1]:
 with tabs[2]:
     st.subheader("🗓️ Programación (Cargo + Mes + Evento) y herencia a personas")
 
-    cargos = read_df("SELECT DISTINCT cargo FROM personas WHERE cargo IS NOT NULL AND cargo<>'' ORDER BY cargo")["cargo"].tolist()
-    eventos = read_df("SELECT id_evento, tema_general, nombre_evento, duracion_horas FROM eventos ORDER BY tema_general, nombre_evento")
+    cargos = cached_read("SELECT DISTINCT cargo FROM personas WHERE cargo IS NOT NULL AND cargo<>'' ORDER BY cargo")["cargo"].tolist()
+    eventos = cached_read("SELECT id_evento, tema_general, nombre_evento, duracion_horas FROM eventos ORDER BY tema_general, nombre_evento")
 
     if len(cargos) == 0 or len(eventos) == 0:
         st.warning("Primero carga personas y eventos (usa ‘Forzar recarga’ en la barra lateral).")
@@ -557,17 +766,17 @@ with tabs[2]:
                          for _, r in eventos.iterrows()}
             picks = st.multiselect("Eventos", list(ev_labels.keys()))
             if st.button("✅ Guardar programación"):
-                for label in picks:
-                    exec_sql(
-                        "INSERT OR IGNORE INTO programacion(id_evento, cargo, mes) VALUES(?,?,?)",
-                        (str(ev_labels[label]), cargo_sel, mes_sel)
+                with transaction() as c:
+                    c.executemany(
+                        SQL_INSERT_PROGRAMACION,
+                        [(str(ev_labels[label]), cargo_sel, mes_sel) for label in picks]
                     )
                 st.success("Programación guardada.")
                 st.rerun()
 
         st.divider()
 
-        prog = read_df("""
+        prog = cached_read("""
             SELECT p.mes, p.cargo, e.id_evento, e.tema_general, e.nombre_evento, e.duracion_horas
             FROM programacion p
             JOIN eventos e ON e.id_evento = p.id_evento
@@ -575,7 +784,7 @@ with tabs[2]:
             ORDER BY e.tema_general, e.nombre_evento
         """, (cargo_sel, mes_sel))
 
-        pers_cargo = read_df("""
+        pers_cargo = cached_read("""
             SELECT id_persona, nombre, cargo, proceso, lugar_trabajo
             FROM personas
             WHERE cargo=?
@@ -599,17 +808,15 @@ with tabs[2]:
         if len(prog) == 0:
             st.info("No hay eventos programados para ese cargo/mes.")
         else:
-            view = pers_cargo.assign(key=1).merge(prog.assign(key=1), on="key").drop(columns=["key"])
-            # el merge puede crear cargo_x/cargo_y
-            if "cargo" not in view.columns:
-                if "cargo_x" in view.columns:
-                    view = view.rename(columns={"cargo_x": "cargo"})
-                elif "cargo_y" in view.columns:
-                    view = view.rename(columns={"cargo_y": "cargo"})
-
-            cols = ["id_persona", "nombre", "cargo", "mes", "id_evento", "tema_general", "nombre_evento", "duracion_horas"]
-            cols = [c for c in cols if c in view.columns]  # por seguridad
-            view = view[cols]
+            view = cached_read("""
+                SELECT pr.id_persona, pr.nombre, pr.cargo, p.mes,
+                       e.id_evento, e.tema_general, e.nombre_evento, e.duracion_horas
+                FROM programacion p
+                JOIN eventos e ON e.id_evento = p.id_evento
+                JOIN personas pr ON pr.cargo = p.cargo
+                WHERE p.cargo=? AND p.mes=?
+                ORDER BY pr.nombre, e.tema_general, e.nombre_evento
+            """, (cargo_sel, mes_sel))
 
             st.dataframe(view, use_container_width=True, height=420)
 
@@ -619,33 +826,39 @@ with tabs[2]:
 with tabs[3]:
     st.subheader("✅ Registro de ejecución (simula Forms) y validación vs programación")
 
-    personas = read_df("SELECT id_persona, nombre, cargo FROM personas ORDER BY nombre")
-    eventos = read_df("SELECT id_evento, nombre_evento, tema_general, duracion_horas FROM eventos ORDER BY tema_general, nombre_evento")
+    personas = cached_read("SELECT id_persona, nombre, cargo FROM personas ORDER BY nombre")
+    eventos = cached_read("SELECT id_evento, nombre_evento, tema_general, duracion_horas FROM eventos ORDER BY tema_general, nombre_evento")
 
     if len(personas) == 0 or len(eventos) == 0:
         st.warning("Carga personas y eventos.")
     else:
         c1, c2, c3 = st.columns([2, 2, 2])
         with c1:
-            p_label = st.selectbox("Persona", [f"{r['nombre']} ({r['id_persona']})" for _, r in personas.iterrows()])
+            p_idx = st.selectbox(
+                "Persona", range(len(personas)),
+                format_func=lambda i: f"{personas.at[i, 'nombre']} ({personas.at[i, 'id_persona']})"
+            )
         with c2:
-            e_label = st.selectbox("Evento", [f"{r['tema_general']} — {r['nombre_evento']} ({r['id_evento']})" for _, r in eventos.iterrows()])
+            e_idx = st.selectbox(
+                "Evento", range(len(eventos)),
+                format_func=lambda i: f"{eventos.at[i, 'tema_general']} — {eventos.at[i, 'nombre_evento']} ({eventos.at[i, 'id_evento']})"
+            )
         with c3:
             fecha = st.date_input("Fecha de ejecución", value=date.today())
 
-        pid = p_label.split("(")[-1].replace(")", "").strip()
-        eid = e_label.split("(")[-1].replace(")", "").strip()
+        pid = personas.at[p_idx, "id_persona"]
+        eid = eventos.at[e_idx, "id_evento"]
 
-        dur = float(eventos[eventos["id_evento"] == eid]["duracion_horas"].iloc[0])
+        dur = float(eventos.at[e_idx, "duracion_horas"])
         colA, colB, colC = st.columns([1, 1, 2])
         with colA:
             horas = st.number_input("Horas", min_value=0.25, value=dur, step=0.25)
         with colB:
             resultado = st.selectbox("Resultado", ["Aprobó", "Reprobó"])
         with colC:
-            cargo_persona = personas[personas["id_persona"] == pid]["cargo"].iloc[0]
+            cargo_persona = personas.at[p_idx, "cargo"]
             mes = month_start(fecha)
-            is_prog = read_df("""
+            is_prog = cached_read("""
                 SELECT COUNT(*) AS n
                 FROM programacion
                 WHERE id_evento=? AND cargo=? AND mes=?
@@ -657,16 +870,13 @@ with tabs[3]:
                 st.warning(f"⚠️ Fuera de programación (Cargo: {cargo_persona} | Mes: {mes})")
 
         if st.button("💾 Guardar ejecución"):
-            exec_sql("""
-                INSERT INTO registro(id_persona, id_evento, fecha_ejecucion, horas, resultado)
-                VALUES(?,?,?,?,?)
-            """, (pid, eid, fecha.isoformat(), float(horas), resultado))
+            exec_sql(SQL_INSERT_REGISTRO, (pid, eid, fecha.isoformat(), float(horas), resultado))
             st.success("Ejecución registrada.")
             st.rerun()
 
         st.divider()
         st.markdown("### Últimos registros de ejecución")
-        reg = read_df("""
+        reg = cached_read("""
             SELECT r.id, r.fecha_ejecucion, r.id_persona, p.nombre, p.cargo,
                    r.id_evento, e.nombre_evento, r.horas, r.resultado
             FROM registro r
@@ -683,30 +893,13 @@ with tabs[3]:
 with tabs[4]:
     st.subheader("📊 Dashboard — Indicadores solicitados")
 
-    pers = read_df("SELECT * FROM personas")
-    ev = read_df("SELECT * FROM eventos")
-    prog = read_df("SELECT * FROM programacion")
-    reg = read_df("SELECT * FROM registro")
+    # cada indicador trae solo sus columnas agregadas; aquí basta con los conteos
+    n_pers, n_ev, n_prog, n_reg = table_counts()
 
-    if len(pers) == 0 or len(ev) == 0:
+    if n_pers == 0 or n_ev == 0:
         st.warning("Carga datos primero.")
     else:
-        # joins para dashboard
-        if len(reg) > 0:
-            reg2 = reg.merge(ev[["id_evento", "tema_general", "nombre_evento"]], on="id_evento", how="left") \
-                     .merge(pers[["id_persona", "nombre", "cargo"]], on="id_persona", how="left")
-            reg2["fecha_ejecucion"] = pd.to_datetime(reg2["fecha_ejecucion"], errors="coerce")
-            reg2["mes"] = reg2["fecha_ejecucion"].dt.to_period("M").dt.to_timestamp().dt.date.astype(str)
-        else:
-            reg2 = pd.DataFrame()
-
-        # programación heredada a personas
-        if len(prog) > 0:
-            pers_cargo = pers[["id_persona", "cargo"]].copy()
-            prog_persona = prog.merge(pers_cargo, on="cargo", how="left")  # id_evento,cargo,mes,id_persona
-        else:
-            prog_persona = pd.DataFrame(columns=["id_evento", "cargo", "mes", "id_persona"])
-
+        # los joins y agregados se resuelven en SQLite; aquí solo llegan las filas agregadas
         sub_tabs = st.tabs([
             "Horas por Persona",
             "Resultado por Temas",
@@ -717,25 +910,43 @@ with tabs[4]:
 
         with sub_tabs[0]:
             st.markdown("## ⏱️ Cantidad de horas de Formación por Persona")
-            if len(reg2) == 0:
+            if n_reg == 0:
                 st.info("No hay ejecuciones registradas aún.")
             else:
-                horas_persona = reg2.groupby(["id_persona", "nombre", "cargo"], as_index=False)["horas"].sum()
-                horas_persona = horas_persona.sort_values("horas", ascending=False)
+                horas_persona = cached_read("""
+                    SELECT r.id_persona, pr.nombre, pr.cargo, SUM(r.horas) AS horas
+                    FROM registro r
+                    JOIN personas pr ON pr.id_persona = r.id_persona
+                    GROUP BY r.id_persona, pr.nombre, pr.cargo
+                    ORDER BY horas DESC
+                """)
                 st.dataframe(horas_persona, use_container_width=True, height=420)
 
         with sub_tabs[1]:
             st.markdown("## ✅ Resultado (Aprobó / Reprobó) según temas")
-            if len(reg2) == 0:
+            if n_reg == 0:
                 st.info("No hay ejecuciones registradas aún.")
             else:
-                res_tema = reg2.groupby(["tema_general", "resultado"], as_index=False).size().rename(columns={"size": "conteo"})
+                res_tema = cached_read("""
+                    SELECT e.tema_general, r.resultado, COUNT(*) AS conteo
+                    FROM registro r
+                    JOIN eventos e ON e.id_evento = r.id_evento
+                    WHERE e.tema_general IS NOT NULL AND r.resultado IS NOT NULL
+                    GROUP BY e.tema_general, r.resultado
+                    ORDER BY e.tema_general, r.resultado
+                """)
                 st.dataframe(res_tema, use_container_width=True, height=420)
 
         with sub_tabs[2]:
             st.markdown("## 🎯 Cobertura: Personas Programadas vs Personas que han recibido formación")
-            personas_programadas = int(prog_persona["id_persona"].nunique()) if len(prog_persona) else 0
-            personas_formadas = int(reg["id_persona"].nunique()) if len(reg) else 0
+            cob = cached_read("""
+                SELECT (SELECT COUNT(DISTINCT id_persona)
+                          FROM personas
+                          WHERE cargo IN (SELECT cargo FROM programacion)) AS programadas,
+                       (SELECT COUNT(DISTINCT id_persona) FROM registro) AS formadas
+            """)
+            personas_programadas = int(cob.at[0, "programadas"])
+            personas_formadas = int(cob.at[0, "formadas"])
 
             cA, cB, cC = st.columns(3)
             cA.metric("Personas programadas", personas_programadas)
@@ -744,11 +955,15 @@ with tabs[4]:
 
         with sub_tabs[3]:
             st.markdown("## 🧪 Eficacia: Programados vs Ejecutados")
-            eventos_programados = int(len(prog))
-            if len(reg2) > 0:
-                eventos_ejecutados = int(reg2[["id_evento", "fecha_ejecucion"]].dropna().drop_duplicates().shape[0])
-            else:
-                eventos_ejecutados = 0
+            eventos_programados = int(n_prog)
+            # DISTINCT se resuelve sobre idx_reg_evento_fecha, sin leer la tabla
+            eventos_ejecutados = int(cached_read("""
+                SELECT COUNT(*) AS n FROM (
+                    SELECT DISTINCT id_evento, fecha_ejecucion
+                    FROM registro
+                    WHERE id_evento IS NOT NULL AND fecha_ejecucion IS NOT NULL
+                )
+            """).iat[0, 0])
 
             cA, cB, cC = st.columns(3)
             cA.metric("Eventos programados (cargo/mes/evento)", eventos_programados)
@@ -757,21 +972,28 @@ with tabs[4]:
 
         with sub_tabs[4]:
             st.markdown("## 📅 Cumplimiento de la programación mes a mes")
-            if len(prog) == 0:
+            if n_prog == 0:
                 st.info("No hay programación aún.")
             else:
-                prog_mes = prog.groupby("mes", as_index=False).size().rename(columns={"size": "programados"})
-                if len(reg2) > 0:
-                    reg_mes = reg2.groupby("mes", as_index=False).size().rename(columns={"size": "ejecutados"})
-                    cum = prog_mes.merge(reg_mes, on="mes", how="left").fillna(0)
-                else:
-                    cum = prog_mes.assign(ejecutados=0)
-
-                cum["cumplimiento_%"] = cum.apply(
-                    lambda r: 0 if r["programados"] == 0 else round(100 * r["ejecutados"] / r["programados"], 2),
-                    axis=1
+                # meses de la programación; registro se agrupa por el primer día de su mes
+                cum = cached_read("""
+                    SELECT p.mes, p.programados, COALESCE(r.ejecutados, 0) AS ejecutados
+                    FROM (SELECT mes, COUNT(*) AS programados FROM programacion GROUP BY mes) p
+                    LEFT JOIN (
+                        SELECT strftime('%Y-%m-01', fecha_ejecucion) AS mes, COUNT(*) AS ejecutados
+                        FROM registro
+                        GROUP BY 1
+                    ) r ON r.mes = p.mes
+                    ORDER BY p.mes
+                """)
+
+                programados = cum["programados"].to_numpy(dtype=float)
+                ejecutados = cum["ejecutados"].to_numpy(dtype=float)
+                cum["cumplimiento_%"] = np.where(
+                    programados == 0, 0.0,
+                    np.round(100 * ejecutados / np.where(programados == 0, 1, programados), 2)
                 )
-                st.dataframe(cum.sort_values("mes"), use_container_width=True, height=420)
+                st.dataframe(cum, use_container_width=True, height=420)
 
 # =========================
 # 6) Export / Entrega
@@ -779,18 +1001,13 @@ with tabs[4]:
 with tabs[5]:
     st.subheader("📦 Exportables + Nota para entregar")
 
-    pers = read_df("SELECT * FROM personas")
-    ev = read_df("SELECT * FROM eventos")
-    prog = read_df("SELECT * FROM programacion")
-    reg = read_df("SELECT * FROM registro")
-
     c1, c2 = st.columns(2)
     with c1:
         st.markdown("### Exportables")
-        st.download_button("⬇️ Personas.csv", pers.to_csv(index=False).encode("utf-8"), "Personas.csv", "text/csv")
-        st.download_button("⬇️ Eventos.csv", ev.to_csv(index=False).encode("utf-8"), "Eventos.csv", "text/csv")
-        st.download_button("⬇️ Programacion.csv", prog.to_csv(index=False).encode("utf-8"), "Programacion.csv", "text/csv")
-        st.download_button("⬇️ Registro.csv", reg.to_csv(index=False).encode("utf-8"), "Registro.csv", "text/csv")
+        st.download_button("⬇️ Personas.csv", table_csv("personas"), "Personas.csv", "text/csv")
+        st.download_button("⬇️ Eventos.csv", table_csv("eventos"), "Eventos.csv", "text/csv")
+        st.download_button("⬇️ Programacion.csv", table_csv("programacion"), "Programacion.csv", "text/csv")
+        st.download_button("⬇️ Registro.csv", table_csv("registro"), "Registro.csv", "text/csv")
         st.caption("Power BI puede conectarse a estos CSV o directo a la base SQLite (capacitaciones.db).")
 
     with c2: